@@ -0,0 +1,68 @@
+"""
+Shared pooled HTTP session for the Swarm FM helpers.
+
+The scripts in this repo all talk to the same couple of hosts; funneling
+their direct HTTP traffic through one aiohttp ClientSession keeps TCP
+connections, TLS sessions and DNS cache entries warm across callers, and
+warm() lets the first real request skip the cold handshake entirely.
+
+aiohttp is optional everywhere in this repo: get_session() returns None when
+it is missing and callers fall back to their stdlib paths.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Optional
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional accelerator
+    aiohttp = None  # type: ignore
+
+_session: Optional["aiohttp.ClientSession"] = None
+
+
+def get_session() -> Optional["aiohttp.ClientSession"]:
+    """Return the shared ClientSession, creating it lazily.
+
+    Must be called from within a running event loop. Returns None when
+    aiohttp is not installed.
+    """
+    global _session
+    if aiohttp is None:
+        return None
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=75, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=5),
+        )
+    return _session
+
+
+def warm(url: str) -> Optional["asyncio.Task"]:
+    """Start a background HEAD so DNS+TCP+TLS are in flight before first use.
+
+    Purely opportunistic: failures are swallowed, and None is returned when
+    there is no session to warm.
+    """
+    session = get_session()
+    if session is None:
+        return None
+
+    async def _head():
+        try:
+            async with session.head(url, allow_redirects=False):
+                pass
+        except Exception:
+            pass
+
+    return asyncio.create_task(_head())
+
+
+async def close_session():
+    """Close the shared session; safe to call when none was ever created."""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
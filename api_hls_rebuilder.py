@@ -9,7 +9,8 @@ How it works:
 
 Prereqs:
 - ffmpeg on PATH.
-- No extra Python deps (uses urllib/json).
+- No extra Python deps required (orjson and aiohttp are used if installed for
+  faster JSON decoding and pooled async polling).
 
 Usage:
   python api_hls_rebuilder.py --http-port 8080
@@ -19,7 +20,11 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import asyncio
+import errno
+import http.client
 import json
+import mmap
 import os
 import shutil
 import signal
@@ -27,12 +32,25 @@ import subprocess
 import sys
 import threading
 import time
-import urllib.error
-import urllib.request
+import urllib.parse
+from collections import deque
+from functools import lru_cache
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Optional
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional accelerator
+    orjson = None  # type: ignore
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional accelerator
+    aiohttp = None  # type: ignore
+
+import _http
+
 API_URL_DEFAULT = os.getenv("SWARMFM_API_URL", "https://swarmfm.boopdev.com/v2/player")
 MEDIA_URL_TEMPLATE = os.getenv("SWARMFM_MEDIA_TEMPLATE", "https://swarmfm.boopdev.com/assets/music/{id}.mp3")
 OUT_DIR_DEFAULT = os.getenv("SWARMFM_HLS_DIR", "hls_out")
@@ -41,14 +59,165 @@ SEGMENT_SECONDS_DEFAULT = float(os.getenv("SWARMFM_HLS_SEGMENT_SECONDS", "6"))
 HTTP_PORT_DEFAULT = int(os.getenv("SWARMFM_HLS_HTTP_PORT", "8080"))
 POLL_SECONDS_DEFAULT = float(os.getenv("SWARMFM_API_POLL_SECONDS", "1"))
 FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
-
-
-def fetch_state(api_url: str) -> Optional[dict]:
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+# Sentinel returned by fetch_state when the server answered 304 Not Modified.
+UNCHANGED = object()
+
+# How long after an early track jump to distrust API reports of the old track.
+SWITCHBACK_GRACE_SECONDS = 10.0
+
+
+@lru_cache(maxsize=8)
+def _probe_audio_codec(media_url: str) -> Optional[str]:
+    """Ask ffprobe for the source's first audio codec name; None on failure."""
+    cmd = [
+        FFPROBE_BIN,
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=codec_name",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        media_url,
+    ]
     try:
-        with urllib.request.urlopen(api_url, timeout=5) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except (urllib.error.URLError, json.JSONDecodeError):
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
         return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+@lru_cache(maxsize=4)
+def _media_url(track_id: str) -> str:
+    # The same track id recurs for a couple hundred polls in a row; cache the
+    # formatted URL instead of rebuilding the string each time.
+    return MEDIA_URL_TEMPLATE.format(id=track_id)
+
+
+class _KeepAliveClient:
+    """Persistent-connection HTTP client for polling a single endpoint.
+
+    ``urllib.request.urlopen`` opens a fresh TCP (and TLS) connection per call,
+    which dominates the cost of fetching the tiny player-state JSON. Reusing
+    one keep-alive connection cuts each poll down to a single round trip.
+    """
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._conn_key: Optional[tuple[str, str]] = None
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+            self._conn_key = None
+
+    def get(self, url: str, headers: Optional[dict] = None) -> tuple[int, http.client.HTTPMessage, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        send_headers = {"Connection": "keep-alive", "Accept": "application/json"}
+        if headers:
+            send_headers.update(headers)
+        # The server may close an idle keep-alive connection between polls, so
+        # retry once on a fresh connection before giving up.
+        for attempt in (1, 2):
+            if self._conn is None or self._conn_key != key:
+                self.close()
+                conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                self._conn = conn_cls(parts.netloc, timeout=self.timeout)
+                self._conn_key = key
+            try:
+                self._conn.request("GET", path, headers=send_headers)
+                resp = self._conn.getresponse()
+                body = resp.read()
+                return resp.status, resp.headers, body
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+        raise AssertionError("unreachable")
+
+
+class _SpawnedProcess:
+    """Popen-compatible handle for a pid launched with os.posix_spawnp.
+
+    Exposes the subset of the Popen API the rebuilder uses (poll, wait,
+    terminate, kill) on top of os.waitpid/os.kill.
+    """
+
+    def __init__(self, pid: int, args: list[str]):
+        self.pid = pid
+        self.args = args
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                self.returncode = 0
+                return self.returncode
+            if pid == self.pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if self.returncode is not None:
+            return self.returncode
+        if timeout is None:
+            _pid, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+            return self.returncode
+        deadline = time.monotonic() + timeout
+        while self.poll() is None:
+            if time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def _signal(self, sig: int):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+
+def _spawn_process(cmd: list[str], stdout_fd: Optional[int] = None, stderr_fd: Optional[int] = None):
+    """Launch a child process, preferring posix_spawn on Linux.
+
+    subprocess.Popen goes through fork(), which duplicates the parent's page
+    tables — needlessly expensive once the interpreter has a large RSS.
+    posix_spawnp uses vfork+execve on glibc, skipping that copy. stdout_fd/
+    stderr_fd are dup2'd over the child's fds 1/2 when given (None inherits).
+    """
+    if sys.platform.startswith("linux"):
+        file_actions = []
+        if stdout_fd is not None:
+            file_actions.append((os.POSIX_SPAWN_DUP2, stdout_fd, 1))
+        if stderr_fd is not None:
+            file_actions.append((os.POSIX_SPAWN_DUP2, stderr_fd, 2))
+        pid = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions)
+        return _SpawnedProcess(pid, cmd)
+    return subprocess.Popen(cmd, stdout=stdout_fd, stderr=stderr_fd)
 
 
 def extract_track(state: dict) -> Optional[tuple[str, float, Optional[float]]]:
@@ -82,6 +251,9 @@ def extract_next(state: dict) -> Optional[tuple[str, Optional[float]]]:
 def sanitize_state_for_log(state: Optional[dict]) -> Optional[dict]:
     if not state or not isinstance(state, dict):
         return state
+    # Copy only when there is actually something to strip.
+    if not any(isinstance(state.get(key), dict) and "lyrics" in state[key] for key in ("track", "current")):
+        return state
     cleaned = dict(state)
     for key in ("track", "current"):
         track = cleaned.get(key)
@@ -101,6 +273,7 @@ class HLSRebuilder:
         segment_seconds: float,
         poll_seconds: float,
         verbose: bool,
+        copy_audio: bool = False,
     ):
         self.api_url = api_url
         self.out_dir = out_dir
@@ -108,36 +281,159 @@ class HLSRebuilder:
         self.segment_seconds = segment_seconds
         self.poll_seconds = poll_seconds
         self._ffmpeg_proc: Optional[subprocess.Popen] = None
+        self._next_proc: Optional[subprocess.Popen] = None
+        self._next_track_id: Optional[str] = None
+        self._live_target: str = playlist_name
+        self._switched_from: Optional[str] = None
+        self._switched_from_at: float = 0.0
+        self._http = _KeepAliveClient()
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._last_track: Optional[tuple[str, float, Optional[float]]] = None
+        self._last_next: Optional[tuple[str, Optional[float]]] = None
         self._stop = threading.Event()
+        self._stop_async: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._current_track: Optional[str] = None
         self.verbose = verbose
+        self.copy_audio = copy_audio
+        # Static portions of the ffmpeg command line, built once; per spawn
+        # only the codec choice, input URL, seek offset and output paths get
+        # spliced in.
+        self._ffmpeg_prefix = (
+            FFMPEG_BIN,
+            "-re",
+            "-reconnect",
+            "1",
+            "-reconnect_streamed",
+            "1",
+            "-reconnect_delay_max",
+            "2",
+        )
+        self._ffmpeg_transcode_opts = (
+            "-vn",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "192k",
+            "-ar",
+            "48000",
+            "-ac",
+            "2",
+        )
+        self._ffmpeg_hls_opts = (
+            "-f",
+            "hls",
+            "-hls_time",
+            str(self.segment_seconds),
+            "-hls_list_size",
+            "8",
+            "-hls_flags",
+            "delete_segments+omit_endlist+temp_file",
+            "-avoid_negative_ts",
+            "make_zero",
+            "-copyts",
+            "-hls_segment_filename",
+        )
         self._ensure_out_dir()
         self._write_placeholder_playlist()
 
     def stop(self):
         self._stop.set()
+        if self._loop is not None and self._stop_async is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_async.set)
+            except RuntimeError:
+                pass  # loop already closed
         self._kill_ffmpeg()
+        self._http.close()
+
+    def _conditional_headers(self) -> dict:
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        return headers
+
+    @staticmethod
+    def _decode_state(body: bytes) -> Optional[dict]:
+        try:
+            # orjson parses the bytes directly, skipping the intermediate str.
+            if orjson is not None:
+                return orjson.loads(body)
+            return json.loads(body.decode("utf-8"))
+        except ValueError:
+            return None
 
-    def _kill_ffmpeg(self):
-        if self._ffmpeg_proc and self._ffmpeg_proc.poll() is None:
+    async def fetch_state(self):
+        """Fetch the player state; returns a dict, UNCHANGED on a 304, or None."""
+        if self._session is not None:
             try:
-                self._ffmpeg_proc.terminate()
+                async with self._session.get(self.api_url, headers=self._conditional_headers()) as resp:
+                    if resp.status == 304:
+                        return UNCHANGED
+                    if resp.status != 200:
+                        return None
+                    self._etag = resp.headers.get("ETag")
+                    self._last_modified = resp.headers.get("Last-Modified")
+                    body = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+            return self._decode_state(body)
+        # No aiohttp: run the keep-alive stdlib client off the loop thread.
+        return await asyncio.to_thread(self._fetch_state_blocking)
+
+    def _fetch_state_blocking(self):
+        try:
+            status, resp_headers, body = self._http.get(self.api_url, headers=self._conditional_headers())
+            if status == 304:
+                return UNCHANGED
+            if status != 200:
+                return None
+            self._etag = resp_headers.get("ETag")
+            self._last_modified = resp_headers.get("Last-Modified")
+            return self._decode_state(body)
+        except (OSError, http.client.HTTPException):
+            return None
+
+    @staticmethod
+    def _kill_proc(proc: Optional[subprocess.Popen]):
+        if proc and proc.poll() is None:
+            try:
+                proc.terminate()
             except Exception:
                 pass
             try:
-                self._ffmpeg_proc.wait(timeout=5)
+                proc.wait(timeout=5)
             except Exception:
-                self._ffmpeg_proc.kill()
+                proc.kill()
+
+    def _kill_ffmpeg(self):
+        self._kill_proc(self._ffmpeg_proc)
         self._ffmpeg_proc = None
+        self._kill_next()
+
+    def _kill_next(self):
+        self._kill_proc(self._next_proc)
+        self._next_proc = None
+        self._next_track_id = None
 
     def _clean_out_dir(self):
-        if self.out_dir.exists():
-            for item in self.out_dir.iterdir():
-                if item.is_file() or item.is_symlink():
-                    item.unlink(missing_ok=True)
-                elif item.is_dir():
-                    shutil.rmtree(item, ignore_errors=True)
-        else:
+        # scandir's DirEntry answers the file/dir question from the directory
+        # read itself, avoiding the extra stat per segment that iterdir paid.
+        try:
+            with os.scandir(self.out_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
             self.out_dir.mkdir(parents=True, exist_ok=True)
 
     def _ensure_out_dir(self):
@@ -149,117 +445,428 @@ class HLSRebuilder:
         placeholder = "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:10\n#EXT-X-MEDIA-SEQUENCE:0\n#EXT-X-ENDLIST\n"
         (self.out_dir / self.playlist_name).write_text(placeholder, encoding="utf-8")
 
-    def _start_ffmpeg(self, track_id: str, media_url: str, start_at: float):
+    def _next_playlist_name(self, track_id: str) -> str:
+        return f"next_{track_id}.m3u8"
+
+    def _start_ffmpeg(self, track_id: str, media_url: str, start_at: float, codec: Optional[str] = None):
         self._kill_ffmpeg()
         self._clean_out_dir()
         self._write_placeholder_playlist()
-        playlist_path = self.out_dir / self.playlist_name
-        segment_path = self.out_dir / f"{track_id}_%03d.ts"
+        self._live_target = self.playlist_name
+        self._ffmpeg_proc = self._spawn_ffmpeg(track_id, media_url, start_at, self.playlist_name, codec)
+
+    def _prewarm_next(self, next_id: str, media_url: str, codec: Optional[str] = None):
+        """Start segmenting the next track into out_dir while the current plays.
+
+        Segment names are already prefixed with the track id, so the two
+        ffmpeg processes never collide; the pre-warmed one writes its own
+        playlist which _promote_next swaps in at the switch.
+        """
+        if self._next_proc is not None:
+            if self._next_track_id == next_id and self._next_proc.poll() is None:
+                return
+            self._kill_next()
+        if self.verbose:
+            print(f"Pre-warming next track {next_id} -> {media_url}")
+        self._next_proc = self._spawn_ffmpeg(next_id, media_url, 0.0, self._next_playlist_name(next_id), codec)
+        self._next_track_id = next_id
+
+    def _promote_next(self) -> bool:
+        """Swap the pre-warmed next-track stream in without wiping out_dir.
+
+        The served playlist name becomes a symlink (installed via an atomic
+        rename) to the playlist the pre-warmed ffmpeg keeps updating, so
+        players never see a restart gap while the processes change over.
+        """
+        if self._next_proc is None or self._next_proc.poll() is not None:
+            self._kill_next()
+            return False
+        target = self._next_playlist_name(self._next_track_id)
+        if not (self.out_dir / target).exists():
+            return False  # ffmpeg hasn't emitted its first playlist yet
+        tmp_link = self.out_dir / f".{self.playlist_name}.tmp"
+        try:
+            tmp_link.unlink(missing_ok=True)
+            tmp_link.symlink_to(target)
+            os.replace(tmp_link, self.out_dir / self.playlist_name)
+        except OSError:
+            tmp_link.unlink(missing_ok=True)
+            return False
+        old_id, old_target = self._current_track, self._live_target
+        self._switched_from = old_id
+        self._switched_from_at = time.monotonic()
+        self._kill_proc(self._ffmpeg_proc)
+        self._ffmpeg_proc, self._next_proc = self._next_proc, None
+        self._current_track, self._next_track_id = self._next_track_id, None
+        self._live_target = target
+        # The finished track's ffmpeg is gone, so its delete_segments no
+        # longer applies; drop its leftovers ourselves.
+        if old_target != self.playlist_name:
+            (self.out_dir / old_target).unlink(missing_ok=True)
+        if old_id:
+            for stale in self.out_dir.glob(f"{old_id}_*.ts"):
+                stale.unlink(missing_ok=True)
+        return True
+
+    async def _start_ffmpeg_off_loop(self, track_id: str, media_url: str, start_at: float):
+        """Restart ffmpeg without blocking the event loop.
+
+        The terminate/wait on the old process (up to 5s plus the SIGKILL
+        follow-up), the out_dir sweep and the spawn are all synchronous, and
+        since the loop also serves every HLS listener they run in a worker
+        thread — the same treatment the ffprobe call gets. The poll loop
+        awaits the result, so process state is never mutated concurrently.
+        """
+        codec = await self._probe_codec(media_url)
+        await asyncio.to_thread(self._start_ffmpeg, track_id, media_url, start_at, codec)
+
+    def _is_stale_switchback(self, track_id: str, position: float) -> bool:
+        """True while the API still reports the track we just jumped away from.
+
+        After an early jump the API keeps announcing the dying track for a few
+        polls; switching back would cold-restart it mid-tail and then restart
+        the new track again one poll later. Trust the report again once the
+        position resets (a genuine replay) or the grace period passes.
+        """
+        if track_id != self._switched_from:
+            return False
+        if position <= 1.0:
+            return False
+        return time.monotonic() - self._switched_from_at < SWITCHBACK_GRACE_SECONDS
+
+    async def _probe_codec(self, media_url: str) -> Optional[str]:
+        """Probe the source codec without blocking the event loop.
+
+        The loop also serves every HLS listener (and ffprobe hits the remote
+        URL, up to its 10s timeout), so the probe runs in a worker thread.
+        """
+        if not self.copy_audio:
+            return None
+        return await asyncio.to_thread(_probe_audio_codec, media_url)
+
+    def _codec_opts(self, codec: Optional[str]) -> tuple[str, ...]:
+        """Pick remux vs transcode given the pre-probed source codec.
+
+        MP3 and AAC both mux straight into MPEG-TS, so with --copy-audio the
+        real-time decode+re-encode is skipped entirely when ffprobe confirmed
+        the source codec; anything else (or a failed probe) transcodes as
+        before.
+        """
+        if self.copy_audio:
+            if codec in ("mp3", "aac"):
+                if self.verbose:
+                    print(f"Source codec {codec} accepted; remuxing without transcode")
+                return ("-vn", "-c:a", "copy")
+            if self.verbose:
+                print(f"Source codec {codec!r} not copyable; transcoding")
+        return self._ffmpeg_transcode_opts
+
+    def _spawn_ffmpeg(
+        self,
+        track_id: str,
+        media_url: str,
+        start_at: float,
+        playlist_name: str,
+        codec: Optional[str] = None,
+    ) -> subprocess.Popen:
+        playlist_path = self.out_dir / playlist_name
+        # Per-spawn nonce: a restart mid-track (or a replayed track) would
+        # otherwise regenerate {id}_000.ts with different bytes under the same
+        # name, which immutable-honoring caches would never refetch.
+        spawn_tag = os.urandom(4).hex()
+        segment_path = self.out_dir / f"{track_id}_{spawn_tag}_%03d.ts"
         cmd = [
-            FFMPEG_BIN,
-            "-re",
-            "-reconnect",
-            "1",
-            "-reconnect_streamed",
-            "1",
-            "-reconnect_delay_max",
-            "2",
+            *self._ffmpeg_prefix,
             "-i",
             media_url,
             "-ss",
             str(start_at),
-            "-vn",
-            "-c:a",
-            "aac",
-            "-b:a",
-            "192k",
-            "-ar",
-            "48000",
-            "-ac",
-            "2",
-            "-f",
-            "hls",
-            "-hls_time",
-            str(self.segment_seconds),
-            "-hls_list_size",
-            "8",
-            "-hls_flags",
-            "delete_segments+omit_endlist",
-            "-avoid_negative_ts",
-            "make_zero",
-            "-copyts",
-            "-hls_segment_filename",
+            *self._codec_opts(codec),
+            *self._ffmpeg_hls_opts,
             str(segment_path),
             str(playlist_path),
         ]
-        print(f"Starting ffmpeg: {' '.join(cmd)}")
+        if self.verbose:
+            print(f"Starting ffmpeg: {' '.join(cmd)}")
+        # Never let ffmpeg inherit our stdio: if that ends up a reader-less
+        # pipe, ffmpeg eventually blocks on stderr and segmenting stalls.
         try:
-            self._ffmpeg_proc = subprocess.Popen(cmd)
+            if self.verbose:
+                proc = self._spawn_with_stderr_tail(cmd)
+            else:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                try:
+                    proc = _spawn_process(cmd, stdout_fd=devnull, stderr_fd=devnull)
+                finally:
+                    os.close(devnull)
         except FileNotFoundError:
             raise RuntimeError("ffmpeg not found; install it or set FFMPEG_BIN") from None
         if self.verbose:
-            print(f"ffmpeg PID: {self._ffmpeg_proc.pid}")
+            print(f"ffmpeg PID: {proc.pid}")
+        return proc
+
+    @staticmethod
+    def _spawn_with_stderr_tail(cmd: list[str]):
+        """Spawn with stderr piped into a ring buffer drained by a daemon thread.
 
-    def loop(self):
+        Keeps the last lines of ffmpeg chatter around for crash diagnostics
+        without ever letting a full pipe buffer back-pressure the encoder.
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            proc = _spawn_process(cmd, stderr_fd=write_fd)
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        tail: deque[str] = deque(maxlen=200)
+        proc.stderr_tail = tail
+
+        def _drain():
+            with os.fdopen(read_fd, "r", errors="replace") as pipe_in:
+                for line in pipe_in:
+                    tail.append(line.rstrip("\n"))
+
+        threading.Thread(target=_drain, daemon=True).start()
+        return proc
+
+    async def loop(self):
         if self.verbose:
             print(f"Polling {self.api_url} every {self.poll_seconds}s")
+        self._loop = asyncio.get_running_loop()
+        self._stop_async = asyncio.Event()
+        if self._stop.is_set():
+            self._stop_async.set()
+        self._session = _http.get_session()
+        if self._session is not None:
+            # Get the API handshake in flight before the first real poll.
+            _http.warm(self.api_url)
+        try:
+            await self._poll_loop()
+        finally:
+            self._session = None
+            await _http.close_session()
+
+    async def _poll_loop(self):
         while not self._stop.is_set():
-            state = fetch_state(self.api_url)
-            if self.verbose:
-                print(f"Fetched state: {sanitize_state_for_log(state)!r}")
-            track = extract_track(state) if state else None
-            nxt = extract_next(state) if state else None
+            state = await self.fetch_state()
+            fresh = state is not UNCHANGED
+            if not fresh:
+                # Nothing new on the wire; reuse the last parsed state and skip
+                # the re-extract/logging work.
+                track, nxt = self._last_track, self._last_next
+            else:
+                if self.verbose:
+                    print(f"Fetched state: {sanitize_state_for_log(state)!r}")
+                track = extract_track(state) if state else None
+                nxt = extract_next(state) if state else None
+                self._last_track, self._last_next = track, nxt
 
             # If ffmpeg died, restart with current track/position.
             if self._ffmpeg_proc and self._ffmpeg_proc.poll() is not None:
                 if self.verbose:
                     print(f"ffmpeg exited with code {self._ffmpeg_proc.returncode}; restarting.")
+                    tail = getattr(self._ffmpeg_proc, "stderr_tail", None)
+                    if tail:
+                        print("ffmpeg stderr tail:")
+                        for line in list(tail)[-20:]:
+                            print(f"  {line}")
                 self._ffmpeg_proc = None
                 if nxt:
                     next_id, _ = nxt
-                    media_url = MEDIA_URL_TEMPLATE.format(id=next_id)
+                    media_url = _media_url(next_id)
                     self._current_track = next_id
-                    self._start_ffmpeg(next_id, media_url, 0.0)
-                elif track:
+                    await self._start_ffmpeg_off_loop(next_id, media_url, 0.0)
+                elif track and not self._is_stale_switchback(track[0], track[1]):
                     track_id, position, duration = track
-                    media_url = MEDIA_URL_TEMPLATE.format(id=track_id)
+                    media_url = _media_url(track_id)
                     self._current_track = track_id
-                    self._start_ffmpeg(track_id, media_url, position)
+                    await self._start_ffmpeg_off_loop(track_id, media_url, position)
 
-            if track:
+            # Switch/pre-warm decisions only ever run on a fresh 200: a 304's
+            # cached position is stale, and acting on it after an early jump
+            # flip-flops the rebuilder between the old and new track.
+            if track and fresh:
                 track_id, position, duration = track
                 remaining = (duration - position) if duration is not None else None
                 next_id = nxt[0] if nxt else None
 
                 # If we're on a new track, start it.
                 if track_id != self._current_track:
-                    media_url = MEDIA_URL_TEMPLATE.format(id=track_id)
-                    print(
-                        f"Switching to track {track_id} @ {position:.2f}s "
-                        f"(duration={duration}, next={next_id}) -> {media_url}"
-                    )
-                    self._current_track = track_id
-                    self._start_ffmpeg(track_id, media_url, position)
-                else:
-                    # If we're near the end and we know the next track, jump early.
-                    if remaining is not None and remaining <= 1.0 and next_id and next_id != self._current_track:
-                        media_url = MEDIA_URL_TEMPLATE.format(id=next_id)
+                    if self._is_stale_switchback(track_id, position):
+                        if self.verbose:
+                            print(f"Ignoring stale report of just-left track {track_id} @ {position:.2f}s")
+                    elif self._next_track_id == track_id and await asyncio.to_thread(self._promote_next):
+                        print(f"Promoted pre-warmed track {track_id} (next={next_id})")
+                    else:
+                        media_url = _media_url(track_id)
                         print(
-                            f"Pre-switching to next track {next_id} at tail of current "
-                            f"(remaining {remaining:.2f}s) -> {media_url}"
+                            f"Switching to track {track_id} @ {position:.2f}s "
+                            f"(duration={duration}, next={next_id}) -> {media_url}"
                         )
-                        self._current_track = next_id
-                        self._start_ffmpeg(next_id, media_url, 0.0)
-            else:
+                        self._current_track = track_id
+                        await self._start_ffmpeg_off_loop(track_id, media_url, position)
+                elif remaining is not None and next_id and next_id != self._current_track:
+                    # Near the end of the current track, warm up the next one
+                    # so the switch is a playlist swap rather than a restart.
+                    if remaining <= 2 * self.segment_seconds and self._next_track_id != next_id:
+                        media_url = _media_url(next_id)
+                        codec = await self._probe_codec(media_url)
+                        await asyncio.to_thread(self._prewarm_next, next_id, media_url, codec)
+                    # At the very tail, jump early like before.
+                    if remaining <= 1.0:
+                        if self._next_track_id == next_id and await asyncio.to_thread(self._promote_next):
+                            print(
+                                f"Pre-switched to pre-warmed track {next_id} "
+                                f"(remaining {remaining:.2f}s)"
+                            )
+                        else:
+                            media_url = _media_url(next_id)
+                            print(
+                                f"Pre-switching to next track {next_id} at tail of current "
+                                f"(remaining {remaining:.2f}s) -> {media_url}"
+                            )
+                            self._switched_from = self._current_track
+                            self._switched_from_at = time.monotonic()
+                            self._current_track = next_id
+                            await self._start_ffmpeg_off_loop(next_id, media_url, 0.0)
+            elif fresh:
                 if self.verbose:
                     print("No valid track info found in API response.")
-            time.sleep(self.poll_seconds)
+            await self._sleep_until_next_poll(track if fresh else None)
+
+    async def _sleep_until_next_poll(self, fresh_track):
+        """Sleep poll_seconds, or longer when the track timeline allows it.
+
+        Mid-song the API has nothing new to say, so with fresh position and
+        duration in hand we sleep until just before the pre-warm window opens
+        (capped so a crashed ffmpeg is still noticed quickly). A stale 304
+        position is never trusted for a long sleep. stop() interrupts the
+        wait for clean shutdown.
+        """
+        delay = self.poll_seconds
+        if fresh_track is not None:
+            _track_id, position, duration = fresh_track
+            if duration is not None:
+                tail_margin = 2 * self.segment_seconds + self.poll_seconds
+                idle = duration - position - tail_margin
+                delay = max(self.poll_seconds, min(idle, 30.0))
+        try:
+            await asyncio.wait_for(self._stop_async.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Small cache of read-only mmaps for hot segment files, shared across server
+# threads. Every listener fetches the same live segments within seconds, so
+# repeat requests reuse the same kernel pages instead of re-buffering reads.
+_MMAP_CACHE_MAX = 8
+_mmap_cache: dict[str, tuple[int, int, mmap.mmap]] = {}
+_mmap_lock = threading.Lock()
+
+
+def _mapped_file(source) -> Optional[mmap.mmap]:
+    """Return a cached read-only mmap of an open file, or None if not mappable."""
+    try:
+        fd = source.fileno()
+        path = source.name
+        st = os.fstat(fd)
+    except (AttributeError, OSError, ValueError):
+        return None
+    if st.st_size == 0 or not isinstance(path, str):
+        return None
+    with _mmap_lock:
+        entry = _mmap_cache.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        try:
+            mm = mmap.mmap(fd, st.st_size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        # Stale/evicted maps are simply dropped; in-flight writers hold their
+        # own reference, so the munmap happens safely on GC.
+        _mmap_cache[path] = (st.st_mtime_ns, st.st_size, mm)
+        while len(_mmap_cache) > _MMAP_CACHE_MAX:
+            _mmap_cache.pop(next(iter(_mmap_cache)))
+        return mm
+
+
+def _cache_control_for(path: str) -> Optional[str]:
+    """Cache policy by resource kind: playlists mutate, segments never do.
+
+    ffmpeg's rolling-index segment names are never rewritten once on disk, so
+    downstream caches may keep them forever; the playlist must be refetched
+    every time.
+    """
+    path = path.split("?", 1)[0]
+    if path.endswith(".m3u8"):
+        return "no-cache"
+    if path.endswith((".ts", ".m4s")):
+        return "public, max-age=31536000, immutable"
+    return None
 
 
 class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
     def log_message(self, format, *args):
         return  # silence access logs
 
+    def send_response(self, code, message=None):
+        self._status_code = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        # Only successful responses get a cache policy: explicit freshness on
+        # a 404 would let caches pin the error to that URL (RFC 9111).
+        if 200 <= getattr(self, "_status_code", 0) < 300:
+            cache_control = _cache_control_for(self.path)
+            if cache_control:
+                self.send_header("Cache-Control", cache_control)
+        super().end_headers()
+
+    def copyfile(self, source, outputfile):
+        """Serve files with zero-copy sendfile() instead of a read/write loop.
+
+        The base class shuttles chunks through userspace buffers; sendfile
+        moves the bytes kernel-side. Falls back to the buffered copy for
+        sources without a real fd (e.g., the generated directory listing).
+        """
+        if hasattr(os, "sendfile"):
+            try:
+                in_fd = source.fileno()
+                out_fd = outputfile.fileno()
+            except (AttributeError, OSError, ValueError):
+                pass
+            else:
+                outputfile.flush()  # make sure headers precede the payload
+                sent_any = False
+                offset = 0
+                try:
+                    while True:
+                        # Explicit offset: offset=None is Linux-only and the
+                        # BSD/macOS signature rejects it with a TypeError.
+                        sent = os.sendfile(out_fd, in_fd, offset, 1 << 20)
+                        if sent == 0:
+                            return
+                        offset += sent
+                        sent_any = True
+                except (TypeError, NotImplementedError):
+                    if sent_any:
+                        raise
+                except OSError as exc:
+                    # Only fall back if sendfile is unusable for this fd pair
+                    # and nothing has gone out yet; otherwise re-raise like a
+                    # failed write would.
+                    if sent_any or exc.errno not in (errno.EINVAL, errno.ENOTSOCK, errno.ENOSYS):
+                        raise
+        # No usable socket fd (e.g., a future TLS wrap): write the shared
+        # mmap of the file rather than looping over buffered reads.
+        mm = _mapped_file(source)
+        if mm is not None:
+            outputfile.write(mm)
+            return
+        super().copyfile(source, outputfile)
+
 
 def run_http_server(directory: Path, port: int):
     handler = lambda *args, **kwargs: QuietHTTPRequestHandler(*args, directory=str(directory), **kwargs)
@@ -268,6 +875,51 @@ def run_http_server(directory: Path, port: int):
     httpd.serve_forever()
 
 
+async def start_http_server_async(directory: Path, port: int):
+    """Serve the HLS directory from the polling event loop via aiohttp.
+
+    One epoll-driven thread handles every listener socket instead of
+    ThreadingHTTPServer's kernel thread (and stack) per connection; aiohttp's
+    FileResponse also uses sendfile internally where available. Returns the
+    runner so the caller can clean it up on shutdown.
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_static("/", str(directory), show_index=False, follow_symlinks=True)
+
+    async def _add_cache_headers(request, response):
+        # Same successful-response gate as the stdlib handler: a cacheable
+        # 404 would poison the segment URL for downstream caches.
+        if not 200 <= response.status < 300:
+            return
+        cache_control = _cache_control_for(request.path)
+        if cache_control:
+            response.headers["Cache-Control"] = cache_control
+
+    app.on_response_prepare.append(_add_cache_headers)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, None, port)
+    await site.start()
+    print(f"Serving HLS from {directory} on port {port} (playlist: http://<host>:{port}/live.m3u8)")
+    return runner
+
+
+async def _amain(rebuilder: HLSRebuilder, out_dir: Path, port: int):
+    if aiohttp is not None:
+        runner = await start_http_server_async(out_dir, port)
+        try:
+            await rebuilder.loop()
+        finally:
+            await runner.cleanup()
+    else:
+        # Fall back to the threaded stdlib server with its sendfile handler.
+        http_thread = threading.Thread(target=run_http_server, args=(out_dir, port), daemon=True)
+        http_thread.start()
+        await rebuilder.loop()
+
+
 def main(argv=None) -> int:
     parser = argparse.ArgumentParser(description="Rebuild HLS from Swarm FM API")
     parser.add_argument("--api-url", default=API_URL_DEFAULT)
@@ -276,10 +928,20 @@ def main(argv=None) -> int:
     parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS_DEFAULT)
     parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS_DEFAULT)
     parser.add_argument("--http-port", type=int, default=HTTP_PORT_DEFAULT)
+    parser.add_argument(
+        "--copy-audio",
+        action="store_true",
+        help="Remux the source audio into HLS without transcoding when ffprobe confirms the codec allows it.",
+    )
     parser.add_argument("--verbose", action="store_true", help="Enable debug logging.")
     args = parser.parse_args(argv)
 
     out_dir = Path(args.out_dir)
+    if args.out_dir == "hls_out" and Path("/dev/shm").is_dir():
+        # Segments live for a few seconds and are then deleted; when a tmpfs
+        # is available, keep the whole write/read/delete cycle off the disk.
+        out_dir = Path("/dev/shm") / "swarmfm_hls"
+        print(f"Using tmpfs for HLS output: {out_dir} (set --out-dir or SWARMFM_HLS_DIR to override)")
     rebuilder = HLSRebuilder(
         api_url=args.api_url,
         out_dir=out_dir,
@@ -287,11 +949,9 @@ def main(argv=None) -> int:
         segment_seconds=args.segment_seconds,
         poll_seconds=args.poll_seconds,
         verbose=args.verbose,
+        copy_audio=args.copy_audio,
     )
 
-    http_thread = threading.Thread(target=run_http_server, args=(out_dir, args.http_port), daemon=True)
-    http_thread.start()
-
     def handle_signal(signum, frame):
         print(f"Received signal {signum}; shutting down.")
         rebuilder.stop()
@@ -300,7 +960,7 @@ def main(argv=None) -> int:
     signal.signal(signal.SIGINT, handle_signal)
     signal.signal(signal.SIGTERM, handle_signal)
 
-    rebuilder.loop()
+    asyncio.run(_amain(rebuilder, out_dir, args.http_port))
     return 0
 
 
@@ -49,10 +49,22 @@ STREAM_HINTS = (
     ".webm",
 )
 
+# One case-insensitive scan over the URL instead of eight substring searches
+# (plus a lowercase) per response; this runs for every response the page makes.
+_HINT_RE = re.compile("|".join(re.escape(hint) for hint in STREAM_HINTS), re.IGNORECASE)
+
+# Every hint is an extension, so the common case is a single hash lookup on
+# the query-stripped path's suffix; the regex stays as the catch-all for
+# hints buried mid-URL (e.g. a playlist name inside a query argument).
+_HINTS_SET = frozenset(STREAM_HINTS)
+
 
 def is_stream_candidate(url: str, content_type: str | None) -> bool:
-    lowered = url.lower()
-    if any(hint in lowered for hint in STREAM_HINTS):
+    path = url.split("?", 1)[0]
+    dot = path.rfind(".")
+    if dot != -1 and path[dot:].lower() in _HINTS_SET:
+        return True
+    if _HINT_RE.search(url):
         return True
     if content_type and "audio" in content_type.lower():
         return True
@@ -89,9 +101,8 @@ async def sniff_stream_url(player_url: str, wait_ms: int = 12000, auto_install:
     ensure_chromium_installed(auto_install)
 
     candidates: List[str] = []
-
-    async def record_request(route, request):
-        await route.continue_()
+    found_strong = asyncio.Event()
+    pending: set[asyncio.Task] = set()
 
     async with async_playwright() as p:
         browser = await p.chromium.launch(
@@ -103,23 +114,44 @@ async def sniff_stream_url(player_url: str, wait_ms: int = 12000, auto_install:
             ],
         )
         context = await browser.new_context()
-        await context.route("**/*", record_request)
 
+        # No request interception: routing every request through a Python
+        # handler adds an IPC round-trip per subresource, and the response
+        # listener below sees everything we need anyway.
         page = await context.new_page()
 
         async def on_response(resp):
+            url = resp.url
+            # The URL suffix alone classifies the vast majority of hits; only
+            # ask the browser for headers when the URL is inconclusive.
+            if is_stream_candidate(url, None):
+                candidates.append(url)
+                # An HLS playlist is the strongest possible hit; no point
+                # watching the page any longer once one shows up.
+                if url.split("?", 1)[0].lower().endswith(".m3u8"):
+                    found_strong.set()
+                return
             try:
-                headers = resp.headers
+                ct = await resp.header_value("content-type")
             except Exception:
-                headers = {}
-            url = resp.url
-            ct = headers.get("content-type", "")
-            if is_stream_candidate(url, ct):
+                return
+            if ct and is_stream_candidate(url, ct):
                 candidates.append(url)
 
-        page.on("response", lambda resp: asyncio.create_task(on_response(resp)))
+        def queue_response(resp):
+            task = asyncio.create_task(on_response(resp))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        page.on("response", queue_response)
         await page.goto(player_url, wait_until="domcontentloaded")
-        await page.wait_for_timeout(wait_ms)
+        try:
+            await asyncio.wait_for(found_strong.wait(), timeout=wait_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+        # Let in-flight classification tasks settle before tearing down.
+        if pending:
+            await asyncio.gather(*list(pending), return_exceptions=True)
         await browser.close()
 
     # Deduplicate while preserving order.